@@ -1,25 +1,26 @@
 import os
 import re
+import hashlib
 import logging
-import urllib2
+import threading
 import requests
+import tables
+import numpy as np
 import pandas as pd
 import pydap.client
 import pydap.exceptions
-import xray
+import xarray as xr
 
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from requests.exceptions import ConnectionError
-from shutil import move
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from io import BytesIO
+from itertools import islice
+from urllib.request import urlopen
 
-# Support Python 2.7 and 3.x
-try:
-    from io import StringIO
-except ImportError:
-    from cStringIO import StringIO
-
-from exceptions import RequiredVariableNotPresent
+from .exceptions import RequiredVariableNotPresent
 
 class ArgoData(object):
     '''Collection of methods for working with Argo profiling float data.
@@ -42,8 +43,58 @@ class ArgoData(object):
     # Literals for groups stored in local HDF file cache
     _STATUS = 'status'
     _GLOBAL_META = 'global_meta'
+    # All profiles of a float are appended to one table, the keys and urls
+    # of all profiles read (including those without data) are in another.
+    # The tables are named with an id of the set of variables they hold.
+    _FLOAT = 'float_{}_{}'
+    _FLOAT_PROFILES = 'float_{}_{}_profiles'
+    _profile_itemsize = 32
+    _url_itemsize = 256
+    # Argo profile variables of characters (e.g. TEMP_QC) are stored as str
+    _char_suffix = '_QC'
+    _char_itemsize = 8
+
+    # Types of the status columns we use, saves pandas from inferring them.
+    # Floats so that blank values are read as NaN rather than failing.
+    _status_dtypes = {'WMO': 'float64', 'OXYGEN': 'float32',
+                      'GREYLIST': 'float32', 'AGE': 'float32'}
     _coordinates = {'PRES_ADJUSTED', 'LATITUDE', 'LONGITUDE', 'JULD'}
 
+    # Argo JULD values are days since this reference time
+    _juld_epoch = pd.Timestamp('1950-01-01')
+
+    # Argo profile file variables not needed unless asked for in variables,
+    # not reading them saves decoding of the (mostly character) arrays
+    _extra_variables = ('DATA_TYPE', 'FORMAT_VERSION', 'HANDBOOK_VERSION',
+            'REFERENCE_DATE_TIME', 'DATE_CREATION', 'DATE_UPDATE',
+            'PROJECT_NAME', 'PI_NAME', 'STATION_PARAMETERS', 'DATA_CENTRE',
+            'DC_REFERENCE', 'DATA_STATE_INDICATOR', 'PLATFORM_TYPE',
+            'FLOAT_SERIAL_NO', 'FIRMWARE_VERSION', 'WMO_INST_TYPE',
+            'POSITIONING_SYSTEM', 'VERTICAL_SAMPLING_SCHEME',
+            'PRES', 'PRES_QC', 'PRES_ADJUSTED_QC', 'PRES_ADJUSTED_ERROR',
+            'TEMP', 'TEMP_QC', 'TEMP_ADJUSTED_QC', 'TEMP_ADJUSTED_ERROR',
+            'PSAL', 'PSAL_QC', 'PSAL_ADJUSTED_QC', 'PSAL_ADJUSTED_ERROR',
+            'DOXY', 'DOXY_QC', 'DOXY_ADJUSTED_QC', 'DOXY_ADJUSTED_ERROR',
+            'PARAMETER', 'SCIENTIFIC_CALIB_EQUATION',
+            'SCIENTIFIC_CALIB_COEFFICIENT', 'SCIENTIFIC_CALIB_COMMENT',
+            'SCIENTIFIC_CALIB_DATE', 'HISTORY_INSTITUTION', 'HISTORY_STEP',
+            'HISTORY_SOFTWARE', 'HISTORY_SOFTWARE_RELEASE',
+            'HISTORY_REFERENCE', 'HISTORY_DATE', 'HISTORY_ACTION',
+            'HISTORY_PARAMETER', 'HISTORY_START_PRES', 'HISTORY_STOP_PRES',
+            'HISTORY_PREVIOUS_VALUE', 'HISTORY_QCTEST')
+
+    # Compress as the data are written so that the cache file does not
+    # need to be repacked to keep its size reasonable
+    _complevel = 5
+    _complib = 'blosc:zstd'
+
+    # Concurrent requests, kept small so as not to be throttled by the servers
+    _catalog_workers = 5
+    _profile_workers = 8
+
+    # Seconds to wait for a response from the servers
+    _request_timeout = 30
+
     # Names and search patterns for cache file naming/parsing
     # Make private and ignore pylint's complaints
     # No other names in this class can end in 'RE'
@@ -52,6 +103,9 @@ class ArgoData(object):
     _profilesRE = 'profiles([0-9]+)'
     _pressureRE = 'pressure([0-9]+)'
 
+    # Profile key part of an OpenDAP profile url: <wmo>_<profilenumber>
+    _wmo_profile_re = re.compile(r"(\d+_\d+)\.nc$")
+
     def __init__(self, verbosity=0, cache_file=None, oxygen_required=True,
             status_url='http://argo.jcommops.org/FTPRoot/Argo/Status/argo_all.txt',
             global_url='ftp://ftp.ifremer.fr/ifremer/argo/ar_index_global_meta.txt',
@@ -93,10 +147,26 @@ class ArgoData(object):
         self.global_url = global_url
         self.thredds_url = thredds_url
         self.variables = set(variables)
+        # Sorted so that the columns match those of tables already in the cache
+        self._non_coord_vars = tuple(sorted(self.variables - self._coordinates))
+        self._char_vars = tuple(v for v in self._non_coord_vars 
+                                if v.endswith(self._char_suffix))
+        # Objects with different variables can share a cache file, their
+        # profile tables have different columns so are kept apart
+        self._variables_id = hashlib.md5(','.join(sorted(self.variables)).encode(
+                                                        'utf-8')).hexdigest()[:8]
+        self._drop_variables = [v for v in self._extra_variables
+                                if v not in self.variables]
 
         self.logger.setLevel(self._log_levels[verbosity])
         self._oxygen_required = oxygen_required
 
+        # Reuse connections (HTTP keep-alive) across all requests
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=3)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
         if cache_file:
             self.cache_file_parms = self._get_cache_file_parms(cache_file)
             self.cache_file = cache_file
@@ -105,133 +175,201 @@ class ArgoData(object):
             self.cache_file = os.path.abspath(os.path.join(
                               os.path.dirname(__file__), 'oxyfloat_cache.hdf'))
 
+        # HDFStore is opened on first use and kept open until close(),
+        # access is serialized as profiles are fetched in multiple threads
+        self._store = None
+        self._store_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Flush and close the cache_file if it is open and close the
+        connections of the requests session.
+        '''
+        self._close_store()
+        self._session.close()
+
+    def _close_store(self):
+        '''Flush and close the cache_file if it is open.
+        '''
+        with self._store_lock:
+            if self._store is not None:
+                self.logger.debug('store.close()')
+                self._store.close()
+                self._store = None
+
+    def _flush_store(self):
+        '''Write what has been saved to cache_file out to disk.
+        '''
+        with self._store_lock:
+            if self._store is not None:
+                self.logger.debug('store.flush()')
+                self._store.flush(fsync=True)
+
+    def _get_store(self):
+        '''Return the open HDFStore for cache_file, opening it if needed.
+        '''
+        if self._store is None:
+            self.logger.debug('Opening %s', self.cache_file)
+            self._store = pd.HDFStore(self.cache_file, mode='a',
+                                      complevel=self._complevel,
+                                      complib=self._complib)
+        return self._store
+
     def _repack_hdf(self):
-        '''Execute the ptrepack command on the cache_file.
+        '''Copy cache_file to a new compressed file and replace it. Data are
+        compressed as they are written, this is only needed to reclaim space
+        left by overwritten nodes, e.g. once after building a fixed cache file.
         '''
-        # For some reason the HDF file grows unreasonable large. These
-        # commands compress the file saving a lot of disk space.
-        f = 'ptrepack --chunkshape=auto --propindexes --complevel=9 --complib=blosc {} {}'
-        tmp_file = '{}.tmp'.format(self.cache_file)
-        self.logger.debug('Running ptrepack on %s', self.cache_file)
-        ret = os.system(f.format(self.cache_file, tmp_file))
-        self.logger.debug('return code = %s', ret)
-        self.logger.debug('Moving tmp file back to original')
-        ret = move(tmp_file, self.cache_file)
-        self.logger.debug('return code = %s', ret)
-
-    def _put_df(self, df, name, metadata=None, append_profile_key=False):
-        '''Save Pandas DataFrame to local HDF file with optional metadata dict.
+        self._close_store()
+        tmp_file = f'{self.cache_file}.tmp'
+        self.logger.debug('Repacking %s', self.cache_file)
+        tables.copy_file(self.cache_file, tmp_file, overwrite=True,
+                         propindexes=True,
+                         filters=tables.Filters(complevel=self._complevel,
+                                                complib=self._complib,
+                                                shuffle=True))
+        self.logger.debug('Replacing original with tmp file')
+        os.replace(tmp_file, self.cache_file)
+
+    def _put_df(self, df, name):
+        '''Save Pandas DataFrame to local HDF file.
         '''
-        store = pd.HDFStore(self.cache_file)
         self.logger.debug('Saving DataFrame to name "%s" in file %s',
                                               name, self.cache_file)
-        store[name] = df
-        if metadata:
-            store.get_storer(name).attrs.metadata = metadata
-        ##if append_profile_key and not df.empty:
-        ##    store.append('profile_keys', pd.Series(name))
-        self.logger.debug('store.close()')
-        store.close()
-
-    def _get_df(self, name):
-        '''Get Pandas DataFrame from local HDF file or raise KeyError.
+        with self._store_lock:
+            self._get_store().put(name, df, format='fixed')
+
+    def _append_df(self, df, name, data_columns=None, min_itemsize=None):
+        '''Append Pandas DataFrame to table in local HDF file.
         '''
-        store = pd.HDFStore(self.cache_file)
-        try:
-            self.logger.debug('Getting "%s" from %s', name, self.cache_file)
-            df = store[name]
-        except (IOError, KeyError):
-            raise
-        finally:
-            self.logger.debug('store.close()')
-            store.close()
+        self.logger.debug('Appending DataFrame to name "%s" in file %s',
+                                              name, self.cache_file)
+        with self._store_lock:
+            self._get_store().append(name, df, format='table',
+                                     data_columns=data_columns,
+                                     min_itemsize=min_itemsize)
 
-        return df
+    def _get_df(self, name, where=None):
+        '''Get Pandas DataFrame from local HDF file or raise KeyError.
+        Tables may be queried with where.
+        '''
+        self.logger.debug('Getting "%s" from %s', name, self.cache_file)
+        with self._store_lock:
+            return self._get_store().select(name, where=where)
 
     def _status_to_df(self):
         '''Read the data at status_url link and return it as a Pandas DataFrame.
         '''
         self.logger.info('Reading data from %s', self.status_url)
-        req = requests.get(self.status_url)
-        req.encoding = 'UTF-16LE'
+        req = self._session.get(self.status_url, timeout=self._request_timeout)
+
+        # The file is UTF-16LE, skip over the 2 leading BOM bytes and let
+        # the parser decode the bytes rather than building a str first
+        df = pd.read_csv(BytesIO(req.content[2:]), encoding='utf-16-le',
+                         engine='c', dtype=self._status_dtypes)
+
+        # Floats without a WMO number can't be looked up
+        df = df.dropna(subset=['WMO']).astype({'WMO': 'int64'})
 
-        # Had to tell requests the encoding, StringIO makes the text 
-        # look like a file object. Skip over leading BOM bytes.
-        df = pd.read_csv(StringIO(req.text[1:]))
         return df
 
     def _global_meta_to_df(self):
         '''Read the data at global_url link and return it as a Pandas DataFrame.
         '''
         self.logger.info('Reading data from %s', self.global_url)
-        with closing(urllib2.urlopen(self.global_url)) as r:
-            df = pd.read_csv(r, comment='#')
+        if self.global_url.startswith('http'):
+            r = self._session.get(self.global_url, timeout=self._request_timeout,
+                                  stream=True)
+            r.raw.decode_content = True
+            f = r.raw
+        else:
+            # requests does not do ftp
+            r = f = urlopen(self.global_url)
+
+        with closing(r):
+            # Only the file column is used, it has the DAC and wmo number
+            df = pd.read_csv(f, comment='#', usecols=['file'], dtype={'file': str})
 
         return df
 
     def _get_pressures(self, ds, max_pressure):
-        '''From xray ds return tuple of pressures list and pres_indices list.
+        '''From xarray ds return array of pressures shallower than max_pressure,
+        their indices into the profile are range(len(pressures)).
         '''
-        pressures = []
-        pres_indices = []
-        for i, p in enumerate(ds['PRES_ADJUSTED'].values[0]):
-            if p >= max_pressure:
-                break
-            pressures.append(p)
-            pres_indices.append(i)
-
-        if not pressures:
+        pres = ds['PRES_ADJUSTED'][0].values
+
+        # Keep the pressures up to the first one at or beyond max_pressure
+        deeper = np.flatnonzero(pres >= max_pressure)
+        cutoff = deeper[0] if deeper.size else pres.size
+
+        if not cutoff:
             self.logger.warn('No PRES_ADJUSTED values in netCDF file')
 
-        return pressures, pres_indices
+        return pres[:cutoff]
 
     def _profile_to_dataframe(self, wmo, url, max_pressure):
         '''Return a Pandas DataFrame of profiling float data from data at url.
         '''
         self.logger.debug('Opening %s', url)
-        ds = xray.open_dataset(url)
+        # Times and coordinates are not decoded, JULD is converted below
+        ds = xr.open_dataset(url, decode_times=False, decode_coords=False,
+                               drop_variables=self._drop_variables)
 
         self.logger.debug('Checking %s for our desired variables', url)
         for v in self.variables:
             if v not in ds.keys():
-                raise RequiredVariableNotPresent('{} not in {}'.format(v, url))
+                raise RequiredVariableNotPresent(f'{v} not in {url}')
 
-        pressures, pres_indices = self._get_pressures(ds, max_pressure)
+        pressures = self._get_pressures(ds, max_pressure)
 
-        # Make a DataFrame with a hierarchical index for better efficiency
-        # Argo data have a N_PROF dimension always of length 1, hence the [0]
-        tuples = [(wmo, ds['JULD'].values[0], ds['LONGITUDE'].values[0], 
-                        ds['LATITUDE'].values[0], round(pres, 1))
-                                        for pres in pressures]
         df = pd.DataFrame()
-        if tuples:
-            indices = pd.MultiIndex.from_tuples(tuples, names=['wmo', 'time', 
-                                                        'lon', 'lat', 'pressure'])
+        n = len(pressures)
+        if n:
+            # Make a DataFrame with a hierarchical index for better efficiency
+            # Argo data have a N_PROF dimension always of length 1, hence the [0]
+            # Index the lazily loaded variables before reading their values so
+            # that only the needed profile and pressure range are requested
+            time = self._juld_epoch + pd.to_timedelta(ds['JULD'][0].values, 
+                                                      unit='D')
+            indices = pd.MultiIndex.from_arrays([np.full(n, wmo), 
+                            np.full(n, time), 
+                            np.full(n, ds['LONGITUDE'][0].values),
+                            np.full(n, ds['LATITUDE'][0].values), 
+                            pressures.round(1)],
+                            names=['wmo', 'time', 'lon', 'lat', 'pressure'])
+            levels = slice(0, n)
+
             # Add only non-coordinate variables to the DataFrame
-            for v in self.variables ^ self._coordinates:
+            data = {}
+            for v in self._non_coord_vars:
                 try:
-                    s = pd.Series(ds[v].values[0][pres_indices], index=indices)
-                    if s.dropna().empty:
+                    values = ds[v][0, levels].values
+                    if pd.isnull(values).all():
                         self.logger.warn('%s: N_PROF [0] empty, trying [1]', v)
-                        try:
-                            s = pd.Series(ds[v].values[1][pres_indices], index=indices)
-                        except IndexError:
-                            pass
+                        if ds[v].shape[0] > 1:
+                            values = ds[v][1, levels].values
                     self.logger.debug('Added %s to DataFrame', v)
-                    df[v] = s
+                    data[v] = values
                 except KeyError:
                     self.logger.warn('%s not in %s', v, url)
                 except pydap.exceptions.ServerError as e:
                     self.logger.error(e)
 
+            if data:
+                df = pd.DataFrame(data, index=indices)
+
         return df
 
     def _float_profile(self, url):
         '''Return last part of url: <wmo>P<profilenumber>
         '''
-        regex = re.compile(r"(\d+_\d+).nc$")
-        m = regex.search(url)
-        return 'P{:s}'.format(m.group(1))
+        m = self._wmo_profile_re.search(url)
+        return f'P{m.group(1)}'
 
     def set_verbosity(self, verbosity):
         '''Change loglevel. 0: ERROR, 1: WARN, 2: INFO, 3:DEBUG.
@@ -249,13 +387,14 @@ class ArgoData(object):
             df = self._get_df(self._STATUS)
         except (IOError, KeyError):
             self.logger.debug('Could not read status from cache, loading it.')
-            self._put_df(self._status_to_df(), self._STATUS)
-            df = self._get_df(self._STATUS)
+            df = self._status_to_df()
+            self._put_df(df, self._STATUS)
 
-        odf = df.query('(OXYGEN == 1) & (GREYLIST == 0) & (AGE != 0) & '
-                       '(AGE >= {:d})'.format(age_gte))
+        age = df['AGE'].values
+        mask = ((df['OXYGEN'].values == 1) & (df['GREYLIST'].values == 0) &
+                (age != 0) & (age >= age_gte))
 
-        return odf['WMO'].tolist()
+        return df.loc[mask, 'WMO'].tolist()
 
     def get_dac_urls(self, desired_float_numbers):
         '''Return dictionary of Data Assembly Centers keyed by wmo number.
@@ -263,66 +402,65 @@ class ArgoData(object):
         Args:
             desired_float_numbers (list[str]): List of strings of float numbers
         '''
+        # Numbers from get_oxy_floats_from_status() are ints, the file
+        # column of global meta has strings
+        desired = set(str(n) for n in desired_float_numbers)
+
         try:
             df = self._get_df(self._GLOBAL_META)
         except KeyError:
             self.logger.debug('Could not read global_meta, putting it into cache.')
-            self._put_df(self._global_meta_to_df(), self._GLOBAL_META)
-            df = self._get_df(self._GLOBAL_META)
+            df = self._global_meta_to_df()
+            self._put_df(df, self._GLOBAL_META)
 
-        dac_urls = {}
-        for _, row in df.loc[:,['file']].iterrows():
-            floatNum = row['file'].split('/')[1]
-            if floatNum in desired_float_numbers:
-                url = self.thredds_url
-                url += '/'.join(row['file'].split('/')[:2])
-                url += "/profiles/catalog.xml"
-                dac_urls[floatNum] = url
+        # file is <dac>/<wmo>/<wmo>_meta.nc
+        parts = df['file'].str.split('/', n=2, expand=True)
+        matched = parts.loc[parts[1].isin(desired)]
+        dac_urls = {floatNum: 
+                        f'{self.thredds_url}{dac}/{floatNum}/profiles/catalog.xml'
+                    for dac, floatNum in zip(matched[0], matched[1])}
 
         self.logger.debug('Found %s dac_urls', len(dac_urls))
 
         return dac_urls
 
     def get_profile_opendap_urls(self, catalog_url):
-        '''Returns an iterable to the opendap urls for the profiles in catalog.
+        '''Returns a generator of the opendap urls for the profiles in catalog.
         The `catalog_url` is the .xml link for a directory on a THREDDS Data 
-        Server.
+        Server. The XML is parsed only as far as the urls are consumed.
         '''
-        urls = []
         try:
             self.logger.debug("Parsing %s", catalog_url)
-            req = requests.get(catalog_url)
-        except ConnectionError as e:
+            req = self._session.get(catalog_url, timeout=self._request_timeout)
+        except (ConnectionError, Timeout) as e:
             self.logger.error('Cannot open catalog_url = %s', catalog_url)
             self.logger.exception(e)
-            return urls
-
-        soup = BeautifulSoup(req.text, 'html.parser')
+            return
 
         # Expect that this is a standard TDS with dodsC used for OpenDAP
         base_url = '/'.join(catalog_url.split('/')[:4]) + '/dodsC/'
 
         # Pull out <dataset ... urlPath='...nc'> attributes from the XML
-        for e in soup.findAll('dataset', attrs={'urlpath': re.compile("nc$")}):
-            urls.append(base_url + e['urlpath'])
-
-        return urls
+        try:
+            for _, e in etree.iterparse(BytesIO(req.content), events=('start',),
+                                        tag='{*}dataset'):
+                url_path = e.get('urlPath') or ''
+                if url_path.endswith('.nc'):
+                    yield base_url + url_path
+        except etree.XMLSyntaxError as e:
+            self.logger.error('Cannot parse catalog_url = %s', catalog_url)
+            self.logger.exception(e)
 
     def _get_cache_file_parms(self, cache_file):
         '''Return dictionary of constraint parameters from name of fixed cache file.
         '''
-        parm_dict = {}
-        if self._fixed_cache_base in cache_file:
-            for regex in [a for a in dir(self) if not callable(a) and 
-                                                  a.endswith("RE")]:
-                try:
-                    p = re.compile(self.__getattribute__(regex))
-                    m = p.search(cache_file)
-                    parm_dict[regex[1:-2]] = int(m.group(1))
-                except AttributeError:
-                    pass
+        if self._fixed_cache_base not in cache_file:
+            return {}
+
+        matches = {parm: regex.search(cache_file) 
+                   for parm, regex in self._parm_regexes.items()}
 
-        return parm_dict
+        return {parm: int(m.group(1)) for parm, m in matches.items() if m}
 
     def _validate_cache_file_parm(self, parm, value):
         '''Return adjusted parm value so as not to exceed fixed cache file value.
@@ -331,11 +469,8 @@ class ArgoData(object):
         cache_file_value = None
         try:
             cache_file_value = self.cache_file_parms[parm]
-        except KeyError:
-            # Return a ridiculously large integer to force reading all data
-            adjusted_value =  10000000000
-        except AttributeError:
-            # No cache_file sepcified
+        except (KeyError, AttributeError):
+            # No fixed cache file value for parm, use the requested value
             pass
 
         if value and cache_file_value:
@@ -364,9 +499,9 @@ class ArgoData(object):
 
         return df
 
-    def _save_profile(self, url, count, opendap_urls, wmo, key, max_pressure,
-                            float_msg):
-        '''Put profile data into the local HDF cache.
+    def _fetch_profile(self, url, count, opendap_urls, wmo, key, max_pressure,
+                             float_msg):
+        '''Return profile data read from url. Safe to call from multiple threads.
         '''
         try:
             self.logger.info('%s, Profile %s of %s, key = %s', 
@@ -378,10 +513,62 @@ class ArgoData(object):
             self.logger.warn(str(e))
             df = pd.DataFrame()
 
-        self._put_df(df, key, {'url', url}, append_profile_key=True)
+        self.logger.debug(df.head())
 
         return df
 
+    @staticmethod
+    def _to_str(value):
+        '''Return value from a character variable as str, '' if missing.
+        '''
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        if pd.isnull(value):
+            return ''
+        return str(value)
+
+    def _save_profile(self, df, wmo, key, url):
+        '''Append profile data to the float's table in the local HDF cache
+        and record that the profile has been read from url.
+        '''
+        if not df.empty:
+            df = df.reindex(columns=list(self._non_coord_vars))
+            min_itemsize = {'profile': self._profile_itemsize}
+            # HDF tables can't hold bytes, store characters as str with ''
+            # for missing values so that the column types always match
+            for v in self._char_vars:
+                df[v] = [self._to_str(x) for x in df[v]]
+                min_itemsize[v] = self._char_itemsize
+            df['profile'] = key
+            self._append_df(df, self._FLOAT.format(wmo, self._variables_id),
+                            data_columns=['profile'], min_itemsize=min_itemsize)
+
+        self._append_df(pd.DataFrame({'profile': [key], 'url': [url]}), 
+                        self._FLOAT_PROFILES.format(wmo, self._variables_id),
+                        min_itemsize={'profile': self._profile_itemsize,
+                                      'url': self._url_itemsize})
+
+    def _get_saved_profiles(self, wmo):
+        '''Return set of keys of the float's profiles in the local HDF cache.
+        '''
+        name = self._FLOAT_PROFILES.format(wmo, self._variables_id)
+        try:
+            return set(self._get_df(name)['profile'])
+        except KeyError:
+            return set()
+
+    def _get_float_df(self, wmo, keys):
+        '''Return the float's cached data for the profiles in keys.
+        '''
+        try:
+            df = self._get_df(self._FLOAT.format(wmo, self._variables_id),
+                              where=f'profile in {list(keys)!r}')
+        except KeyError:
+            # None of the float's profiles have data
+            return pd.DataFrame()
+
+        return df.drop('profile', axis=1)
+
     def get_float_dataframe(self, wmo_list, max_profiles=None, max_pressure=None,
                                   append_df=True):
         '''Returns Pandas DataFrame for all the profile data from wmo_list.
@@ -394,28 +581,49 @@ class ArgoData(object):
         max_profiles = self._validate_cache_file_parm('profiles', max_profiles)
         max_pressure = self._validate_cache_file_parm('pressure', max_pressure)
 
-        float_df = pd.DataFrame()
-        for f, (wmo, dac_url) in enumerate(self.get_dac_urls(wmo_list).iteritems()):
-            float_msg = 'WMO {}: Float {} of {}'. format(wmo, f+1, len(wmo_list))
-            self.logger.info(float_msg)
-            opendap_urls = self.get_profile_opendap_urls(dac_url)
-            for i, url in enumerate(opendap_urls):
-                if i > max_profiles:
-                    self.logger.info('Stopping at max_profiles = %s', max_profiles)
-                    break
-                key = self._float_profile(url)
-                try:
-                    df = self._get_df(key)
-                except KeyError:
-                    df = self._save_profile(url, i, opendap_urls, wmo, key, 
-                                            max_pressure, float_msg)
+        def profile_urls(catalog_url):
+            # Stop parsing the catalog once max_profiles urls are found
+            return list(islice(self.get_profile_opendap_urls(catalog_url),
+                               max_profiles))
 
-                self.logger.debug(df.head())
-                if append_df:
-                    float_df = float_df.append(df)
+        dac_urls = self.get_dac_urls(wmo_list)
+        with ThreadPoolExecutor(max_workers=self._catalog_workers) as executor:
+            float_urls = dict(zip(dac_urls.keys(), 
+                                  executor.map(profile_urls, dac_urls.values())))
 
-            self.logger.info('Repacking cache file')
-            self._repack_hdf()
+        frames = []
+        for f, (wmo, opendap_urls) in enumerate(float_urls.items()):
+            float_msg = f'WMO {wmo}: Float {f+1} of {len(wmo_list)}'
+            self.logger.info(float_msg)
+            keys = [self._float_profile(url) for url in opendap_urls]
+            saved = self._get_saved_profiles(wmo)
+            with ThreadPoolExecutor(max_workers=self._profile_workers) as executor:
+                futures = []
+                for i, (url, key) in enumerate(zip(opendap_urls, keys)):
+                    if key not in saved:
+                        futures.append((key, url, executor.submit(
+                                        self._fetch_profile, url, i, 
+                                        opendap_urls, wmo, key, max_pressure,
+                                        float_msg)))
+
+                # Writes to the cache are done here, in profile order
+                for key, url, future in futures:
+                    self._save_profile(future.result(), wmo, key, url)
+
+            # Don't leave a float's data only in buffers should the process die
+            self._flush_store()
+
+            if append_df and keys:
+                frames.append(self._get_float_df(wmo, keys))
+
+        # Concatenate once, appending to a DataFrame copies it every time
+        float_df = pd.concat(frames) if frames else pd.DataFrame()
 
         return float_df
 
+
+# Compile the cache file name patterns once: lop off leading '_' and
+# trailing 'RE' from the class variable names to get the parameter names
+ArgoData._parm_regexes = {name[1:-2]: re.compile(value) 
+                          for name, value in vars(ArgoData).items() 
+                          if name.endswith('RE')}
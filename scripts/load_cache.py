@@ -14,17 +14,15 @@ class ArgoDataLoader(object):
         '''Build cache_file short name from command line arguemnts and
         from format descriptors from ArgoData.
         '''
-        # This unfortunately tricky loop finds all class variables in
-        # ArgoData ending with 'RE' (e.g. 'ageRE', 'profilesRE') and
-        # gets the corresponding argument value for building the 
+        # Loop over the parameter names of the class variables in
+        # ArgoData ending with 'RE' (e.g. '_ageRE', '_profilesRE') and
+        # get the corresponding argument value for building the 
         # cache file name. It allows control of items from ArgoData
         # but suffers from having to keep this script's calling
         # arguments in sync with the *RE variables in ArgoData.
 
         cache_file = ArgoData._fixed_cache_base
-        # Lop off leading '_' and trailing 'RE' from regex values in ArgoData
-        for item in [a[1:-2] for a in dir(ArgoData()) 
-                                 if not callable(a) and a.endswith("RE")]:
+        for item in sorted(ArgoData._parm_regexes):
             try:
                 cache_file += '_{}{:d}'.format(item, vars(self.args)[item])
             except (KeyError, ValueError):
@@ -58,6 +56,8 @@ class ArgoDataLoader(object):
         ad.get_float_dataframe(wmo_list, max_profiles=self.args.profiles, 
                                          max_pressure=self.args.pressure,
                                          append_df=False)
+        ad._repack_hdf()
+        ad.close()
 
         print(('Finished loading cache file {}').format(cache_file))
 
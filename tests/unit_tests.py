@@ -3,6 +3,9 @@
 import os
 import sys
 import unittest
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
 parentDir = os.path.join(os.path.dirname(__file__), "../")
 sys.path.insert(0, parentDir)
 
@@ -52,6 +55,112 @@ class DataTest(unittest.TestCase):
         ad = ArgoData(cache_file='/tmp/oxyfloat_cache_file.hdf')
         ad.set_verbosity(1)
 
+    def test_cache_store(self):
+        df = pd.DataFrame({'a': [1, 2, 3]})
+        with ArgoData(cache_file='/tmp/oxyfloat_cache_store.hdf') as ad:
+            ad._put_df(df, 'test')
+            self.assertTrue(ad._get_df('test').equals(df))
+            ad._repack_hdf()
+            self.assertTrue(ad._get_df('test').equals(df))
+        self.assertIsNone(ad._store)
+
+    def _profile_df(self, ad, wmo, n):
+        # Profile data as returned by _profile_to_dataframe()
+        indices = pd.MultiIndex.from_arrays([np.full(n, wmo), 
+                        np.full(n, pd.Timestamp('2015-11-02')), 
+                        np.full(n, -145.0), np.full(n, 50.0), np.arange(n) * 10.0],
+                        names=['wmo', 'time', 'lon', 'lat', 'pressure'])
+        # Character variables come from xarray as bytes
+        return pd.DataFrame({v: np.full(n, b'1', dtype='S1') if v in ad._char_vars
+                                else np.random.rand(n) for v in ad._non_coord_vars},
+                            index=indices)
+
+    def test_float_tables(self):
+        cache_file = '/tmp/oxyfloat_float_tables.hdf'
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        wmo = self.good_oga_floats[0]
+        keys = ['P1900650_001', 'P1900650_002', 'P1900650_003']
+        with ArgoData(cache_file=cache_file) as ad:
+            ad._save_profile(self._profile_df(ad, wmo, 4), wmo, keys[0], 'url1')
+            # Profile without data is recorded, but has no rows
+            ad._save_profile(pd.DataFrame(), wmo, keys[1], 'url2')
+            ad._save_profile(self._profile_df(ad, wmo, 3), wmo, keys[2], 'url3')
+
+            self.assertEqual(ad._get_saved_profiles(wmo), set(keys))
+            df = ad._get_float_df(wmo, keys)
+            self.assertEqual(len(df), 7)
+            self.assertNotIn('profile', df.columns)
+            self.assertEqual(len(ad._get_float_df(wmo, keys[1:])), 3)
+            self.assertTrue(ad._get_float_df(wmo, keys[1:2]).empty)
+
+            # Repacking keeps the table's indexes for the where queries
+            ad._repack_hdf()
+            table = ad._get_store().get_storer(
+                            ad._FLOAT.format(wmo, ad._variables_id)).table
+            self.assertIn('profile', table.colindexes)
+            self.assertEqual(len(ad._get_float_df(wmo, keys[1:])), 3)
+
+        # Different variables in the same cache file are kept separately
+        with ArgoData(cache_file=cache_file, 
+                      variables=('TEMP_ADJUSTED', 'PRES_ADJUSTED', 'LATITUDE',
+                                 'LONGITUDE', 'JULD')) as ad:
+            self.assertEqual(ad._get_saved_profiles(wmo), set())
+            ad._save_profile(self._profile_df(ad, wmo, 2), wmo, keys[0], 'url1')
+            self.assertEqual(len(ad._get_float_df(wmo, keys)), 2)
+
+        # Character variables are stored as str, also when missing from a profile
+        with ArgoData(cache_file=cache_file, 
+                      variables=('TEMP_ADJUSTED', 'TEMP_QC', 'PRES_ADJUSTED',
+                                 'LATITUDE', 'LONGITUDE', 'JULD')) as ad:
+            ad._save_profile(self._profile_df(ad, wmo, 2), wmo, keys[0], 'url1')
+            ad._save_profile(self._profile_df(ad, wmo, 3).drop('TEMP_QC', axis=1),
+                             wmo, keys[2], 'url3')
+            df = ad._get_float_df(wmo, keys)
+            self.assertEqual(list(df['TEMP_QC']), ['1', '1', '', '', ''])
+
+    def test_status_blank_values(self):
+        cache_file = '/tmp/oxyfloat_status.hdf'
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        status = ('WMO,OXYGEN,GREYLIST,AGE\n1900650,1,0,3000\n'
+                  '1900651,1,0,\n1900652,,0,3000\n,1,0,3000\n')
+        response = SimpleNamespace(content=status.encode('utf-16'))
+        with ArgoData(cache_file=cache_file) as ad:
+            ad._session.get = lambda url, timeout: response
+            self.assertEqual(ad.get_oxy_floats_from_status(age_gte=340), 
+                             [1900650])
+
+    def test_max_profiles(self):
+        cache_file = '/tmp/oxyfloat_max_profiles.hdf'
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        wmo = self.good_oga_floats[0]
+        fetched = []
+
+        def profile_urls(catalog_url):
+            for i in range(1, 6):
+                yield f'http://tds/thredds/dodsC/{wmo}_{i:03d}.nc'
+
+        def fetch_profile(url, count, opendap_urls, wmo, key, max_pressure,
+                          float_msg):
+            fetched.append(key)
+            return self._profile_df(ad, wmo, 2)
+
+        with ArgoData(cache_file=cache_file) as ad:
+            ad.get_dac_urls = lambda wmo_list: {w: 'catalog.xml' for w in wmo_list}
+            ad.get_profile_opendap_urls = profile_urls
+            ad._fetch_profile = fetch_profile
+            df = ad.get_float_dataframe([wmo], max_profiles=2)
+            # Profiles are fetched in threads, in no particular order
+            self.assertCountEqual(fetched, ['P1900650_001', 'P1900650_002'])
+            self.assertEqual(ad._get_saved_profiles(wmo), set(fetched))
+            self.assertEqual(len(df), 4)
+
+    def test_cache_file_parms(self):
+        ad = ArgoData(cache_file='/tmp/oxyfloat_fixed_cache_age3000_profiles1.hdf')
+        self.assertEqual(ad.cache_file_parms, {'age': 3000, 'profiles': 1})
+
     def test_fixed_cache_file(self):
         age = 3000      # Returns 1 float on 2 November 2015
         parent_dir = os.path.join(os.path.dirname(__file__), "../")